@@ -1,112 +1,606 @@
 import sqlite3
+import os
+import functools
+import threading
+import atexit
+import asyncio
+import contextlib
+import hashlib
+import re
+import collections
+import statistics
+import io
+import csv
+import itertools
+from concurrent.futures import ThreadPoolExecutor
 from langchain_community.llms import Ollama  # type: ignore # Import from langchain_community
 from langchain_core.prompts import PromptTemplate  # type: ignore # Import from langchain_core
 from langchain_core.runnables import chain  # type: ignore # Import chain
 import requests  # type: ignore # For making HTTP requests
+from requests.adapters import HTTPAdapter  # type: ignore
+from urllib3.util.retry import Retry  # type: ignore
+from urllib3.exceptions import HTTPError as Urllib3HTTPError  # type: ignore
 import json  # For working with JSON data
-import schedule # type: ignore
+try:
+    import orjson  # type: ignore # Faster JSON encoding/decoding when available
+except ImportError:
+    orjson = None
 import time
-from datetime import datetime
+from datetime import datetime, timedelta
 import smtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 
+def _connect(database_path):
+    """Opens a SQLite connection tuned for the read-mostly chatbot workload.
+
+    check_same_thread is off so connections opened on worker threads can be
+    closed by _close_all_connections at exit.
+    """
+    conn = sqlite3.connect(database_path, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA cache_size=-65536")  # 64MB page cache
+    conn.execute("PRAGMA mmap_size=268435456")  # 256MB memory map
+    conn.execute("PRAGMA trusted_schema=OFF")
+    return conn
+
+def _close(conn):
+    """Lets the query planner refresh its statistics, then closes the connection."""
+    try:
+        conn.execute("PRAGMA optimize")
+    finally:
+        conn.close()
+
+# One long-lived connection per (thread, database) so the page cache and
+# statement cache stay warm across chatbot turns. Each connection is only used
+# by the thread that opened it; at exit, after the worker threads have been
+# joined, the main thread closes them all.
+_CONN = threading.local()
+_ALL_CONNS = []
+_ALL_CONNS_LOCK = threading.Lock()
+
+def _get_connection(database_path):
+    """Returns the persistent connection for database_path, opening it on first use."""
+    conns = getattr(_CONN, "conns", None)
+    if conns is None:
+        conns = _CONN.conns = {}
+    conn = conns.get(database_path)
+    if conn is None:
+        conn = conns[database_path] = _connect(database_path)
+        with _ALL_CONNS_LOCK:
+            _ALL_CONNS.append(conn)
+    return conn
+
+@atexit.register
+def _close_all_connections():
+    """Closes every persistent connection, from any thread, when the process exits."""
+    with _ALL_CONNS_LOCK:
+        conns = _ALL_CONNS[:]
+        _ALL_CONNS.clear()
+    for conn in conns:
+        try:
+            _close(conn)
+        except sqlite3.Error as e:
+            print(f"Error closing SQLite connection: {e}")
+
+def _database_mtime(database_path):
+    """Returns the last modification time of the database, including its WAL file.
+
+    An empty WAL file only means a connection was opened, so its mtime is ignored;
+    otherwise every new session would look like a data change.
+    """
+    mtime = os.path.getmtime(database_path)
+    wal_path = database_path + "-wal"
+    try:
+        if os.path.getsize(wal_path) > 0:
+            mtime = max(mtime, os.path.getmtime(wal_path))
+    except OSError:
+        pass  # no WAL file
+    return mtime
+
+@functools.lru_cache(maxsize=8)
+def _schema_cached(database_path, mtime):
+    """Builds the schema description once per (database_path, mtime).
+
+    Each table is described on one DDL-like line, e.g. ``users(id INTEGER PK, name TEXT NOT NULL)``,
+    which keeps the LLM prompt short.
+    """
+    cursor = _get_connection(database_path).cursor()
+    cursor.execute(
+        "SELECT m.name, p.name, p.type, p.\"notnull\", p.pk "
+        "FROM sqlite_master AS m JOIN pragma_table_info(m.name) AS p "
+        "WHERE m.type = 'table' AND m.name NOT LIKE 'sqlite\\_%' ESCAPE '\\' ORDER BY m.name, p.cid"
+    )
+    tables = {}
+    for table, name, type, notnull, pk in cursor.fetchall():
+        column = f"{name} {type}" if type else name
+        if pk:
+            column += " PK"
+        if notnull:
+            column += " NOT NULL"
+        tables.setdefault(table, []).append(column)
+    cursor.close()
+    return "\n".join(f"{table}({', '.join(columns)})" for table, columns in tables.items())
+
 def get_database_schema(database_path):
-    """Retrieves the schema information from the SQLite database."""
-    conn = sqlite3.connect(database_path)
-    cursor = conn.cursor()
-    cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
-    tables = [row[0] for row in cursor.fetchall()]
-    schema_description = ""
-    for table in tables:
-        schema_description += f"\nTable: {table}\n"
-        cursor.execute(f"PRAGMA table_info({table})")
-        columns = cursor.fetchall()
-        for column in columns:
-            cid, name, type, notnull, dflt_value, pk = column
-            schema_description += f"  Column: {name}, Type: {type}"
-            if notnull:
-                schema_description += ", NOT NULL"
-            if pk:
-                schema_description += ", PRIMARY KEY"
-            schema_description += "\n"
-    conn.close()
-    return schema_description
+    """Retrieves the schema information from the SQLite database.
 
-def generate_sql_langchain(prompt, database_path, ollama_model="openchat"):
-    """Generates SQL code using Langchain and Ollama with schema context."""
-    schema_info = get_database_schema(database_path)
-    template = f"""You are a helpful AI assistant that translates natural language queries into SQL code for a SQLite database.
+    The result is cached and only rebuilt when the database file changes.
+    """
+    return _schema_cached(database_path, _database_mtime(database_path))
+
+# Generated SQL is cached in memory and persisted to a sidecar SQLite file so
+# questions asked in earlier sessions are answered without calling Ollama.
+CACHE_DATABASE = "cache.db"
+_SQL_CACHE_SIZE = 2048
+_SQL_CACHE = collections.OrderedDict()
+
+_CACHE_INITIALIZED = set()  # ids of cache connections whose tables have been created
+
+def _get_cache_connection():
+    """Returns the persistent connection to the cache database, creating its tables on first use."""
+    conn = _get_connection(CACHE_DATABASE)
+    if id(conn) not in _CACHE_INITIALIZED:
+        qa_columns = [row[1] for row in conn.execute("PRAGMA table_info(qa)")]
+        if qa_columns and "model" not in qa_columns:
+            conn.execute("DROP TABLE qa")  # answers cached before the model was part of the key
+        conn.executescript(
+            "CREATE TABLE IF NOT EXISTS sql_cache ("
+            "prompt TEXT, schema_hash TEXT, model TEXT, sql TEXT, "
+            "PRIMARY KEY (prompt, schema_hash, model)) WITHOUT ROWID;"
+            "CREATE TABLE IF NOT EXISTS qa ("
+            "prompt TEXT, schema_hash TEXT, model TEXT, data_mtime REAL, sql TEXT, answer TEXT, ts INTEGER, "
+            "PRIMARY KEY (prompt, schema_hash, model)) WITHOUT ROWID;"
+        )
+        _CACHE_INITIALIZED.add(id(conn))
+    return conn
+
+def _qa_cache_get(prompt, schema_hash, model, data_mtime):
+    """Returns the stored answer for prompt and model if neither the schema nor the data changed since, else None."""
+    try:
+        row = _get_cache_connection().execute(
+            "SELECT answer FROM qa WHERE prompt = ? AND schema_hash = ? AND model = ? AND data_mtime = ?",
+            (prompt.strip().lower(), schema_hash, model, data_mtime),
+        ).fetchone()
+    except sqlite3.Error as e:
+        print(f"Answer cache error: {e}")
+        return None
+    return row[0] if row is not None else None
+
+def _qa_cache_put(prompt, schema_hash, model, data_mtime, sql_code, answer):
+    """Stores the full answer for prompt and model, replacing any answer built against older data."""
+    try:
+        with _get_cache_connection() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO qa VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (prompt.strip().lower(), schema_hash, model, data_mtime, sql_code, answer, int(time.time())),
+            )
+    except sqlite3.Error as e:
+        print(f"Answer cache error: {e}")
+
+def _sql_cache_get(key):
+    """Looks up generated SQL in memory, then on disk. Returns None on a miss."""
+    sql_code = _SQL_CACHE.get(key)
+    if sql_code is not None:
+        _SQL_CACHE.move_to_end(key)
+        return sql_code
+    try:
+        row = _get_cache_connection().execute(
+            "SELECT sql FROM sql_cache WHERE prompt = ? AND schema_hash = ? AND model = ?", key
+        ).fetchone()
+    except sqlite3.Error as e:
+        print(f"SQL cache error: {e}")
+        return None
+    if row is not None:
+        _sql_cache_put(key, row[0], persist=False)
+        return row[0]
+    return None
+
+def _sql_cache_put(key, sql_code, persist=True):
+    """Stores generated SQL in memory and, unless persist is False, on disk."""
+    _SQL_CACHE[key] = sql_code
+    _SQL_CACHE.move_to_end(key)
+    while len(_SQL_CACHE) > _SQL_CACHE_SIZE:
+        _SQL_CACHE.popitem(last=False)
+    if persist:
+        try:
+            with _get_cache_connection() as conn:
+                conn.execute("INSERT OR REPLACE INTO sql_cache VALUES (?, ?, ?, ?)", (*key, sql_code))
+        except sqlite3.Error as e:
+            print(f"SQL cache error: {e}")
+
+_SQL_QUOTE_ENDS = {"'": "'", '"': '"', "`": "`", "[": "]"}
+
+def _scan_sql(sql):
+    """Splits SQL text into (kind, start, end) spans.
+
+    kind is "space", "comment" (-- or /* */), "quoted" (a string or quoted
+    identifier, including its quotes) or "char" for any other single character.
+    An unterminated comment or quote runs to the end of the text.
+    """
+    i, n = 0, len(sql)
+    while i < n:
+        ch = sql[i]
+        if ch.isspace():
+            yield "space", i, i + 1
+            i += 1
+        elif sql.startswith("--", i):
+            end = sql.find("\n", i)
+            end = n if end == -1 else end
+            yield "comment", i, end
+            i = end
+        elif sql.startswith("/*", i):
+            end = sql.find("*/", i + 2)
+            end = n if end == -1 else end + 2
+            yield "comment", i, end
+            i = end
+        elif ch in _SQL_QUOTE_ENDS:
+            close = _SQL_QUOTE_ENDS[ch]
+            end = sql.find(close, i + 1)
+            # A doubled quote character is an escaped quote, not the end of the string.
+            while end != -1 and ch != "[" and sql.startswith(close, end + 1):
+                end = sql.find(close, end + 2)
+            end = n if end == -1 else end + 1
+            yield "quoted", i, end
+            i = end
+        else:
+            yield "char", i, i + 1
+            i += 1
+
+def _statement_end(text):
+    """Returns the index just past the first ';' followed by whitespace, or -1.
+
+    Semicolons inside comments, strings and quoted identifiers are ignored.
+    """
+    for kind, start, end in _scan_sql(text):
+        if kind == "char" and text[start] == ";" and end < len(text) and text[end].isspace():
+            return end
+    return -1
+
+def _collect_sql(chunks):
+    """Accumulates streamed LLM output and stops generation once the SQL statement is complete."""
+    text = ""
+    try:
+        for chunk in chunks:
+            text += chunk
+            end = _statement_end(text)
+            if end != -1:
+                text = text[:end]
+                break
+    finally:
+        if hasattr(chunks, "close"):
+            chunks.close()  # tells Ollama to stop decoding the rest of the answer
+    return text.strip()
+
+# Batched LLM responses are split on numbered "### QUERY n" / "### ANSWER n" header lines,
+# which (unlike "---", a Markdown rule) do not show up in normal output.
+BATCH_HEADER = "###"
+
+# The single-query prompt is split around the schema and the user query so the
+# schema part can be pre-built once per schema (see _sql_prompt_prefix).
+SQL_PROMPT_HEAD = """You are a helpful AI assistant that translates natural language queries into SQL code for a SQLite database.
     Here is the schema of the database:
-    {{schema}}
+    """
+SQL_PROMPT_MIDDLE = """
     Only return the SQL code. Do not provide any explanations or surrounding text.
     Make sure to use table and column names exactly as they appear in the schema.
 
-    User query: {{query}}
+    User query: """
+SQL_PROMPT_SUFFIX = """
+    SQL code:
+    """
+# Prompt templates are parsed once at import time instead of on every query.
+BATCH_SQL_PROMPT = PromptTemplate.from_template(f"""You are a helpful AI assistant that translates natural language queries into SQL code for a SQLite database.
+    Here is the schema of the database:
+    {{schema}}
+    Translate each of the numbered user queries below into one SQL statement.
+    Put each SQL statement under a line containing only {BATCH_HEADER} QUERY n, where n is the number of the user query.
+    Do not provide any explanations or surrounding text.
+    Make sure to use table and column names exactly as they appear in the schema.
+
+    User queries:
+    {{queries}}
     SQL code:
+    """)
+
+def _ollama_url(host):
+    """Turns an OLLAMA_HOST value such as ``127.0.0.1:11434`` into a base URL."""
+    host = host.strip().rstrip("/")
+    return host if "://" in host else f"http://{host}"
+
+# Same variable and default as the Ollama server itself, so both code paths reach one server.
+OLLAMA_URL = _ollama_url(os.environ.get("OLLAMA_HOST", "127.0.0.1:11434"))
+
+@functools.lru_cache(maxsize=4)
+def _get_batch_sql_chain(ollama_model):
+    """Returns the batch prompt | llm chain for ollama_model, building it only once per model."""
+    llm = Ollama(model=ollama_model, base_url=OLLAMA_URL)
+    return BATCH_SQL_PROMPT | llm # use the pipe operator
+
+@functools.lru_cache(maxsize=8)
+def _sql_prompt_prefix(schema_info):
+    """Returns the part of the SQL prompt that precedes the user query, built once per schema."""
+    return SQL_PROMPT_HEAD + schema_info + SQL_PROMPT_MIDDLE
+
+def _ollama_stream(prompt, ollama_model):
+    """Streams the completion for a raw prompt from Ollama's /api/generate endpoint.
+
+    Closing the generator closes the HTTP response, which stops generation.
+    """
+    payload = {"model": ollama_model, "prompt": prompt, "stream": True}
+    with _SESSION.post(f"{OLLAMA_URL}/api/generate", data=_json_dumps(payload), stream=True) as response:
+        response.raise_for_status()
+        for line in response.iter_lines():
+            if not line:
+                continue
+            chunk = _json_loads(line)
+            yield chunk.get("response", "")
+            if chunk.get("done"):
+                return
+
+def _schema_hash(schema_info):
+    """Returns a short digest identifying a schema description."""
+    return hashlib.blake2b(schema_info.encode(), digest_size=16).hexdigest()
+
+def _sql_cache_key(prompt, schema_info, ollama_model):
+    """Builds the generated-SQL cache key for a prompt against a given schema and model."""
+    return (prompt.strip().lower(), _schema_hash(schema_info), ollama_model)
+
+def generate_sql_langchain(prompt, database_path, ollama_model="openchat"):
+    """Generates SQL code with Ollama, streaming from its HTTP API with schema context.
+
+    Results are cached by (prompt, schema, model), so repeated questions skip the LLM.
     """
-    prompt_template = PromptTemplate.from_template(template) # use from_template
-    llm = Ollama(model=ollama_model)
-    chain = prompt_template | llm # use the pipe operator
-    sql_code = chain.invoke(input={"schema": schema_info, "query": prompt}).strip() # change from run to invoke and adjust the input
+    schema_info = get_database_schema(database_path)
+    cache_key = _sql_cache_key(prompt, schema_info, ollama_model)
+    sql_code = _sql_cache_get(cache_key)
+    if sql_code is not None:
+        return sql_code
+    full_prompt = _sql_prompt_prefix(schema_info) + prompt + SQL_PROMPT_SUFFIX
+    try:
+        sql_code = _collect_sql(_ollama_stream(full_prompt, ollama_model)) # stream so we can stop at the end of the statement
+    except requests.exceptions.RequestException as e:
+        print(f"Error communicating with Ollama: {e}")
+        return ""
+    if sql_code and validate_sql(database_path, sql_code) is None:  # never cache SQL that cannot run
+        _sql_cache_put(cache_key, sql_code)
     return sql_code
 
-def fetch_data(database_path, sql_query):
-    """Connects to the SQLite database and fetches data."""
+def _split_batch(text, expected, label):
+    """Splits a batched LLM response into its "### <label> n" sections, ordered by n.
+
+    Returns None unless sections 1..expected each appear exactly once and are non-empty.
+    """
+    pattern = rf"^[ \t]*{re.escape(BATCH_HEADER)}[ \t]*{label}[ \t]+(\d+)[ \t]*:?[ \t]*$"
+    headers = list(re.finditer(pattern, text, re.MULTILINE | re.IGNORECASE))
+    blocks = {}
+    for header, next_header in zip(headers, headers[1:] + [None]):
+        n = int(header.group(1))
+        if n in blocks:
+            return None
+        blocks[n] = text[header.end():next_header.start() if next_header else len(text)].strip()
+    if sorted(blocks) != list(range(1, expected + 1)) or not all(blocks.values()):
+        return None
+    return [blocks[n] for n in range(1, expected + 1)]
+
+def generate_sql_batch_langchain(prompts, database_path, ollama_model="openchat"):
+    """Generates SQL for several queries with a single Ollama call.
+
+    The schema is sent once for the whole batch. Falls back to one call per
+    query if the response cannot be split into one block per query. Like
+    generate_sql_langchain, queries get "" when Ollama cannot be reached.
+    """
+    schema_info = get_database_schema(database_path)
+    keys = [_sql_cache_key(prompt, schema_info, ollama_model) for prompt in prompts]
+    results = [_sql_cache_get(key) for key in keys]
+    pending = [i for i, sql_code in enumerate(results) if sql_code is None]
+    if not pending:
+        return results
+    if len(pending) == 1:
+        results[pending[0]] = generate_sql_langchain(prompts[pending[0]], database_path, ollama_model)
+        return results
+
+    queries = "\n".join(f"{n}. {prompts[i]}" for n, i in enumerate(pending, 1))
+    chain = _get_batch_sql_chain(ollama_model)
     try:
-        conn = sqlite3.connect(database_path)
+        response = chain.invoke(input={"schema": schema_info, "queries": queries})
+    except (requests.exceptions.RequestException, ValueError) as e:  # LangChain's Ollama raises ValueError on HTTP errors
+        print(f"Error communicating with Ollama: {e}")
+        for i in pending:
+            results[i] = ""
+        return results
+    blocks = _split_batch(response, len(pending), "QUERY")
+    if blocks is None:
+        print("Could not split batched SQL response, generating queries one at a time.")
+        for i in pending:
+            results[i] = generate_sql_langchain(prompts[i], database_path, ollama_model)
+        return results
+    for i, sql_code in zip(pending, blocks):
+        results[i] = sql_code
+        if validate_sql(database_path, sql_code) is None:
+            _sql_cache_put(keys[i], sql_code)
+    return results
+
+def _normalize_sql(sql_query):
+    """Builds the fetch cache key for sql_query; the key itself is never executed.
+
+    Comments are dropped, whitespace outside quoted strings and identifiers is
+    collapsed and trailing semicolons are removed, so equivalent SQL shares a
+    cache entry. Quoted text is kept verbatim.
+    """
+    parts = []
+    space = False
+    for kind, start, end in _scan_sql(sql_query):
+        if kind in ("space", "comment"):
+            space = True
+            continue
+        if space and parts:
+            parts.append(" ")
+        space = False
+        parts.append(sql_query[start:end])
+    return "".join(parts).rstrip("; ")
+
+# Authorizer actions allowed for LLM-generated SQL: plain reads only.
+_READ_ONLY_ACTIONS = {sqlite3.SQLITE_SELECT, sqlite3.SQLITE_READ, sqlite3.SQLITE_FUNCTION, sqlite3.SQLITE_RECURSIVE}
+
+def _read_only_authorizer(action, arg1, arg2, db_name, trigger):
+    return sqlite3.SQLITE_OK if action in _READ_ONLY_ACTIONS else sqlite3.SQLITE_DENY
+
+@contextlib.contextmanager
+def _read_only(conn):
+    """Rejects any statement prepared on conn that would write to or alter the database."""
+    conn.set_authorizer(_read_only_authorizer)
+    try:
+        yield conn
+    finally:
+        conn.set_authorizer(None)
+
+def validate_sql(database_path, sql_query):
+    """Checks that sql_query compiles and is read-only, without running it.
+
+    Returns None if the query is valid, otherwise the error message.
+    """
+    conn = _get_connection(database_path)
+    try:
+        with _read_only(conn):
+            conn.execute("EXPLAIN " + sql_query).fetchone()
+    except (sqlite3.Error, sqlite3.Warning) as e:
+        return str(e)
+    return None
+
+# Query results keyed by (database_path, mtime, normalized SQL, max_rows).
+_FETCH_CACHE_SIZE = 512
+_FETCH_CACHE = collections.OrderedDict()
+
+class QueryResult(list):
+    """Rows returned by fetch_data, plus the column names and whether max_rows cut the result short."""
+
+    def __init__(self, rows=(), columns=(), truncated=False):
+        super().__init__(rows)
+        self.columns = list(columns)
+        self.truncated = truncated
+
+def _run_query(database_path, sql_query, max_rows):
+    """Runs sql_query read-only and returns at most max_rows rows (all rows if None)."""
+    conn = _get_connection(database_path)
+    with _read_only(conn):
         cursor = conn.cursor()
         cursor.execute(sql_query)
-        data = cursor.fetchall()
-        conn.close()
+        # One extra row tells us whether the result was truncated.
+        rows = cursor.fetchall() if max_rows is None else cursor.fetchmany(max_rows + 1)
+        columns = [column[0] for column in cursor.description or ()]
+        cursor.close()
+    truncated = max_rows is not None and len(rows) > max_rows
+    return QueryResult(rows[:max_rows] if truncated else rows, columns, truncated)
+
+def fetch_data(database_path, sql_query, max_rows=None):
+    """Connects to the SQLite database and fetches data.
+
+    Only the first max_rows rows are fetched when max_rows is given. Results
+    are cached until the database file changes.
+    """
+    key = (database_path, _database_mtime(database_path), _normalize_sql(sql_query), max_rows)
+    data = _FETCH_CACHE.get(key)
+    if data is not None:
+        _FETCH_CACHE.move_to_end(key)
         return data
-    except sqlite3.Error as e:
+    try:
+        data = _run_query(database_path, sql_query, max_rows)  # the original SQL is executed, never the key
+    except (sqlite3.Error, sqlite3.Warning) as e:
         print(f"SQLite error: {e}")
         return None
+    _FETCH_CACHE[key] = data
+    while len(_FETCH_CACHE) > _FETCH_CACHE_SIZE:
+        _FETCH_CACHE.popitem(last=False)
+    return data
 
-def rephrase_answer_deepseek_api(prompt, data):
-    """
-    Rephrases the raw data from the database into a user-friendly answer using the DeepSeek API.
+# Shared HTTP session so the TLS connection to the DeepSeek API is kept alive between questions.
+_SESSION = requests.Session()
+_SESSION.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=16, max_retries=Retry(total=3, backoff_factor=0.5)))
 
-    Args:
-        prompt (str): The original user query.
-        data (list): The data fetched from the database.
-        deepseek_api_key (str): Your DeepSeek API key.
+_DEEPSEEK_WARM_SECONDS = 30  # A connection used this recently is assumed to still be open
+_deepseek_last_used = 0.0
 
-    Returns:
-        str: A user-friendly rephrased answer, or None on error.
+def _warm_up_deepseek():
+    """Opens the pooled DeepSeek connection so the TLS handshake is off the critical path.
+
+    Sends one HEAD request on the session's connection pool, bypassing the
+    adapter's retries, so an unreachable API costs a single attempt.
     """
-    deepseek_api_key = "sk-ab3bdd397ec34efabaa31c516d5acabf"
-    if not data:
-        return "No data found."
+    global _deepseek_last_used
+    adapter = _SESSION.get_adapter(_DEEPSEEK_URL)
+    request = _SESSION.prepare_request(requests.Request("HEAD", _DEEPSEEK_URL))
+    # Same settings the session applies when sending, so the warmed connection lands in the pool the POST uses.
+    # This reaches into HTTPAdapter internals; tested with requests 2.32 and 2.34 (urllib3 2.x). The
+    # get_connection/cert_verify branch follows the API of requests < 2.32.2.
+    settings = _SESSION.merge_environment_settings(request.url, {}, None, None, None)
+    try:
+        if hasattr(adapter, "get_connection_with_tls_context"):  # requests >= 2.32.2
+            pool = adapter.get_connection_with_tls_context(request, settings["verify"], settings["proxies"], settings["cert"])
+        else:
+            pool = adapter.get_connection(request.url, settings["proxies"])
+            adapter.cert_verify(pool, request.url, settings["verify"], settings["cert"])
+        pool.urlopen("HEAD", "/", retries=False, timeout=5)
+        _deepseek_last_used = time.monotonic()
+    except (Urllib3HTTPError, requests.exceptions.RequestException):
+        pass  # the real request will report any connectivity problem
 
-    data_str = "\n".join(str(row) for row in data)
+MAX_PROMPT_ROWS = 200  # Rows beyond this are not sent to DeepSeek
 
-    # Construct the prompt for DeepSeek API
-    deepseek_prompt = f"""
-    You are a helpful AI assistant.
-    The user asked the following question: {prompt}
-    The following data was retrieved from a database:
-    {data_str}
-    Please rephrase the data into a concise and user-friendly answer.
+def _format_rows(data):
+    """Formats database rows as CSV for inclusion in a DeepSeek prompt.
+
+    CSV is more compact than tuple reprs, so the prompt uses fewer input tokens.
+    The column names form the header row, and a note is added when rows were left out.
     """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    columns = getattr(data, "columns", None)
+    if columns:
+        writer.writerow(columns)
+    writer.writerows(itertools.islice(data, MAX_PROMPT_ROWS))
+    if getattr(data, "truncated", False) or len(data) > MAX_PROMPT_ROWS:
+        buffer.write(f"(Only the first {min(len(data), MAX_PROMPT_ROWS)} rows are shown; the query returned more.)\n")
+    return buffer.getvalue()
 
-    url = "https://api.deepseek.com/v1/chat/completions"  # Or the correct DeepSeek API endpoint
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {deepseek_api_key}"  # Include your API key
-    }
+# The DeepSeek API key is read from the environment once at startup.
+_DEEPSEEK_KEY = os.environ.get("DEEPSEEK_API_KEY", "")
+_DEEPSEEK_URL = "https://api.deepseek.com/v1/chat/completions"  # Or the correct DeepSeek API endpoint
+_DEEPSEEK_HEADERS = {
+    "Content-Type": "application/json",
+    "Authorization": f"Bearer {_DEEPSEEK_KEY}"
+}
+
+def _json_dumps(obj, indent=False):
+    """Serializes obj to JSON bytes, using orjson when it is installed."""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 if indent else 0)
+    return json.dumps(obj, indent=2 if indent else None).encode()
+
+def _json_loads(data):
+    """Parses JSON bytes, using orjson when it is installed."""
+    return orjson.loads(data) if orjson is not None else json.loads(data)
+
+def _deepseek_chat(content):
+    """Sends a single-message chat completion to the DeepSeek API and returns the reply, or None on error."""
+    global _deepseek_last_used
+    if not _DEEPSEEK_KEY:
+        print("DEEPSEEK_API_KEY is not set; cannot contact the DeepSeek API.")
+        return None
     payload = {
         "model": "deepseek-chat",  # Or the appropriate DeepSeek model name
         "messages": [
-            {"role": "user", "content": deepseek_prompt}
+            {"role": "user", "content": content}
         ]
     }
 
     try:
-        response = requests.post(url, headers=headers, json=payload)
+        response = _SESSION.post(_DEEPSEEK_URL, headers=_DEEPSEEK_HEADERS, data=_json_dumps(payload))
         response.raise_for_status()  # Raise an exception for bad status codes
-        response_json = response.json()
+        _deepseek_last_used = time.monotonic()
+        response_json = _json_loads(response.content)
         # Adjust the following line to extract the rephrased answer from the DeepSeek response
         rephrased_answer = response_json['choices'][0]['message']['content'].strip()  # Example, adjust as needed.
         return rephrased_answer
@@ -119,75 +613,267 @@ def rephrase_answer_deepseek_api(prompt, data):
     except KeyError as e:
         print(f"Error extracting content from DeepSeek response.  Key not found: {e}")
         return None
+
+def rephrase_answer_deepseek_api(prompt, data):
+    """
+    Rephrases the raw data from the database into a user-friendly answer using the DeepSeek API.
+
+    Args:
+        prompt (str): The original user query.
+        data (list): The data fetched from the database.
+
+    Returns:
+        str: A user-friendly rephrased answer, or None on error.
+    """
+    if not data:
+        return "No data found."
+
+    data_str = _format_rows(data)
+
+    # Construct the prompt for DeepSeek API
+    deepseek_prompt = f"""
+    You are a helpful AI assistant.
+    The user asked the following question: {prompt}
+    The following data was retrieved from a database:
+    {data_str}
+    Please rephrase the data into a concise and user-friendly answer.
+    """
+    return _deepseek_chat(deepseek_prompt)
+
+def rephrase_answers_deepseek_api(prompts, datas):
+    """
+    Rephrases the results of several queries with a single DeepSeek API call.
+
+    Args:
+        prompts (list): The original user queries.
+        datas (list): The data fetched from the database for each query.
+
+    Returns:
+        list: One rephrased answer (or None on error) per query. Like
+        rephrase_answer_deepseek_api, a query without data gets "No data found.".
+    """
+    answers = ["No data found."] * len(datas)
+    pending = [i for i, data in enumerate(datas) if data]
+    if len(pending) <= 1:
+        for i in pending:
+            answers[i] = rephrase_answer_deepseek_api(prompts[i], datas[i])
+        return answers
+
+    sections = "\n".join(
+        f"Question {n}: {prompts[i]}\nData:\n{_format_rows(datas[i])}\n" for n, i in enumerate(pending, 1)
+    )
+    deepseek_prompt = f"""
+    You are a helpful AI assistant.
+    The user asked several questions. For each question, the following data was retrieved from a database:
+    {sections}
+    Please rephrase the data for each question into a concise and user-friendly answer.
+    Put each answer under a line containing only {BATCH_HEADER} ANSWER n, where n is the number of the question.
+    """
+    response = _deepseek_chat(deepseek_prompt)
+    blocks = _split_batch(response, len(pending), "ANSWER") if response else None
+    if blocks is None:
+        for i in pending:
+            answers[i] = rephrase_answer_deepseek_api(prompts[i], datas[i])
+        return answers
+    for i, answer in zip(pending, blocks):
+        answers[i] = answer
+    return answers
+
+def process_batch(prompts, database_path, ollama_model="openchat"):
+    """Answers several user queries, batching both the Ollama and the DeepSeek calls.
+
+    As with answer_query, a query for which no SQL could be generated gets None.
+    """
+    sql_queries = generate_sql_batch_langchain(prompts, database_path, ollama_model)
+    datas = [fetch_data(database_path, sql_query, MAX_PROMPT_ROWS) if sql_query else None for sql_query in sql_queries]
+    answers = rephrase_answers_deepseek_api(prompts, datas)
+    return [answer if sql_query else None for sql_query, answer in zip(sql_queries, answers)]
     
+# Background worker used to overlap network set-up with local SQL generation.
+_BACKGROUND = ThreadPoolExecutor(max_workers=1)
+_warm_up = None
+
+def _start_warm_up():
+    """Warms the DeepSeek connection in the background unless it is already warm or warming."""
+    global _warm_up
+    if not _DEEPSEEK_KEY:
+        return  # DeepSeek is never called without a key
+    if time.monotonic() - _deepseek_last_used < _DEEPSEEK_WARM_SECONDS:
+        return
+    if _warm_up is not None and not _warm_up.done():
+        return
+    _warm_up = _BACKGROUND.submit(_warm_up_deepseek)
+
+def answer_query(prompt, database_path, ollama_model="openchat"):
+    """Answers a natural language query end to end: SQL generation, database fetch and rephrasing.
+
+    Answers are stored in the cache database and reused while the schema and
+    data are unchanged, which skips Ollama, SQLite and DeepSeek entirely.
+    Returns None if no SQL could be generated.
+    """
+    schema_hash = _schema_hash(get_database_schema(database_path))
+    data_mtime = _database_mtime(database_path)
+    answer = _qa_cache_get(prompt, schema_hash, ollama_model, data_mtime)
+    if answer is not None:
+        return answer
+
+    _start_warm_up()  # runs alongside SQL generation; the answer never waits for it
+    sql_query = generate_sql_langchain(prompt, database_path, ollama_model)
+    if not sql_query:
+        return None
+    data = fetch_data(database_path, sql_query, MAX_PROMPT_ROWS)
+    answer = rephrase_answer_deepseek_api(prompt, data)
+    if data is not None and answer is not None:
+        _qa_cache_put(prompt, schema_hash, ollama_model, data_mtime, sql_query, answer)
+    return answer
+
+DATABASE_FILE = "jordan_transactions.db"
+
 # assume there is a database called data that is updated everytime a transaction is created 
 # we will use the dataset you guys provided as an example 
+# Per-location data read by the alert and report jobs, keyed by location name, e.g.
+# {"amman": {"manager_email": ..., "failure_rate": 0.02, "daily_financial_report": {"sales": ...}}}.
+# It is empty until a data source populates it, in which case the jobs do nothing.
+data = {}
 FAILURE_THRESHOLD = 0.05
 ANOMALY_THRESHOLD = 2.0  # Example threshold for anomaly detection (you'll need a proper anomaly detection method)
-SMTP_SERVER = 'your_smtp_server.com'  # Replace with your SMTP server address
-SMTP_PORT = 587  # Or your SMTP port
-SMTP_USERNAME = 'your_email@example.com'  # Replace with your email address
-SMTP_PASSWORD = 'your_email_password'  # Replace with your email password
-EMAIL_FROM = 'system_alerts@example.com'  # Replace with the sender email address
+# SMTP settings are read from the environment; the defaults are placeholders.
+SMTP_SERVER = os.environ.get('SMTP_SERVER', 'your_smtp_server.com')
+SMTP_PORT = int(os.environ.get('SMTP_PORT', 587))
+SMTP_USERNAME = os.environ.get('SMTP_USERNAME', 'your_email@example.com')
+SMTP_PASSWORD = os.environ.get('SMTP_PASSWORD', '')
+EMAIL_FROM = os.environ.get('EMAIL_FROM', 'system_alerts@example.com')
 
-def send_email(to_email, subject, body):
-    """Sends an email."""
-    try:
-        msg = MIMEMultipart()
-        msg['From'] = EMAIL_FROM
-        msg['To'] = to_email
-        msg['Subject'] = subject
-        msg.attach(MIMEText(body, 'plain'))
+EMAIL_WORKERS = 8  # Maximum number of SMTP connections used in parallel for a batch of emails
+
+def _build_message(to_email, subject, body):
+    """Builds the MIME message for an email."""
+    msg = MIMEMultipart()
+    msg['From'] = EMAIL_FROM
+    msg['To'] = to_email
+    msg['Subject'] = subject
+    msg.attach(MIMEText(body, 'plain'))
+    return msg.as_string()
 
+def _send_email_batch(emails):
+    """Sends a list of (to_email, subject, body) tuples over a single SMTP connection."""
+    attempted = 0  # emails already sent or reported as failed
+    try:
         with smtplib.SMTP(SMTP_SERVER, SMTP_PORT) as server:
             server.starttls()
             server.login(SMTP_USERNAME, SMTP_PASSWORD)
-            server.sendmail(EMAIL_FROM, to_email, msg.as_string())
-        print(f"Email sent successfully to {to_email}: {subject}")
+            for to_email, subject, body in emails:
+                try:
+                    server.sendmail(EMAIL_FROM, to_email, _build_message(to_email, subject, body))
+                    print(f"Email sent successfully to {to_email}: {subject}")
+                except Exception as e:
+                    print(f"Error sending email to {to_email}: {e}")
+                attempted += 1
     except Exception as e:
-        print(f"Error sending email to {to_email}: {e}")
+        # Connection-level failure: only the emails not yet attempted were lost.
+        for to_email, _, _ in emails[attempted:]:
+            print(f"Error sending email to {to_email}: {e}")
+
+def send_emails(emails):
+    """Sends several emails, spreading them over up to EMAIL_WORKERS SMTP connections."""
+    emails = list(emails)
+    workers = min(EMAIL_WORKERS, len(emails))
+    if workers <= 1:
+        if emails:
+            _send_email_batch(emails)
+        return
+    batches = [emails[i::workers] for i in range(workers)]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(_send_email_batch, batches))
+
+def send_email(to_email, subject, body):
+    """Sends an email."""
+    _send_email_batch([(to_email, subject, body)])
 
 def check_failure_rates():
     """Checks failure rates against a threshold and alerts managers."""
-    for location, data in data.items():
-        if "failure_rate" in data and data["failure_rate"] > FAILURE_THRESHOLD:
+    threshold = FAILURE_THRESHOLD
+    emails = []
+    for location, loc_data in data.items():
+        if "failure_rate" in loc_data and loc_data["failure_rate"] > threshold:
             subject = f"FAILURE RATE ALERT: {location.capitalize()}"
-            body = f"The failure rate at {location.capitalize()} is {data['failure_rate']:.2%}, which exceeds the threshold of {FAILURE_THRESHOLD:.2%}."
-            send_email(data["manager_email"], subject, body)
+            body = f"The failure rate at {location.capitalize()} is {loc_data['failure_rate']:.2%}, which exceeds the threshold of {threshold:.2%}."
+            emails.append((loc_data["manager_email"], subject, body))
+    send_emails(emails)
 
 def detect_anomalies():
     """Detects anomalies (this is a placeholder and needs a proper implementation)."""
     # In a real system, you would implement a robust anomaly detection algorithm here.
     # This could involve statistical methods, machine learning models, etc.
     # For this example, we'll just flag locations with unusually high values in their financial reports.
-    average_sales = sum(data[loc]["daily_financial_report"]["sales"] for loc in data) / len(data) if data else 0
-    for location, data in data.items():
-        if "daily_financial_report" in data and data["daily_financial_report"]["sales"] > average_sales * ANOMALY_THRESHOLD:
+    # Collect the sales figures in one pass, then compare against the mean of that list.
+    reports = [(location, loc_data, loc_data["daily_financial_report"]["sales"])
+               for location, loc_data in data.items() if "daily_financial_report" in loc_data]
+    average_sales = statistics.fmean(sales for _, _, sales in reports) if reports else 0
+    sales_limit = average_sales * ANOMALY_THRESHOLD
+    emails = []
+    for location, loc_data, sales in reports:
+        if sales > sales_limit:
             subject = f"ANOMALY DETECTED: Unusual Sales at {location.capitalize()}"
-            body = f"Anomalously high sales detected at {location.capitalize()}: {data['daily_financial_report']['sales']} (Average: {average_sales:.2f})."
-            send_email(data["manager_email"], subject, body)
+            body = f"Anomalously high sales detected at {location.capitalize()}: {sales} (Average: {average_sales:.2f})."
+            emails.append((loc_data["manager_email"], subject, body))
         # Add more anomaly detection for other metrics as needed
+    send_emails(emails)
 
 def send_daily_financial_reports():
     """Sends daily financial reports to each location's manager."""
     now = datetime.now()
     subject_prefix = f"Daily Financial Report ({now.strftime('%Y-%m-%d')})"
-    for location, data in data.items():
-        if "daily_financial_report" in data and "manager_email" in data:
-            report = json.dumps(data["daily_financial_report"], indent=4)
+    emails = []
+    for location, loc_data in data.items():
+        if "daily_financial_report" in loc_data and "manager_email" in loc_data:
+            report = _json_dumps(loc_data["daily_financial_report"], indent=True).decode()
             subject = f"{subject_prefix}: {location.capitalize()}"
             body = f"Please find the daily financial report for {location.capitalize()} attached:\n\n{report}"
-            send_email(data["manager_email"], subject, body)
+            emails.append((loc_data["manager_email"], subject, body))
         else:
             print(f"Warning: Could not send daily report for {location}. Missing financial data or manager email.")
+    send_emails(emails)
+
+def create_report_indexes(database_path):
+    """Creates the indexes used by the report queries. Run once at startup, before any caching."""
+    conn = sqlite3.connect(database_path)
+    try:
+        with conn:
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_transactions_month_tax ON transactions "
+                "(substr(transaction_date, 4, 7), transaction_status, transaction_type, tax_amount)"
+            )
+    finally:
+        conn.close()
+
+def monthly_tax_collection(database_path, year, month):
+    """Returns the net tax collected across all locations in the given month.
+
+    The sum is computed by SQLite over the transactions table. It uses the
+    index from create_report_indexes on the month part of transaction_date,
+    which is stored as DD/MM/YYYY HH:MM, when that index exists.
+    """
+    conn = _get_connection(database_path)
+    row = conn.execute(
+        "SELECT TOTAL(CASE WHEN transaction_type = 'Refund' THEN -tax_amount ELSE tax_amount END) "
+        "FROM transactions WHERE substr(transaction_date, 4, 7) = ? AND transaction_status = 'Completed'",
+        (f"{month:02d}/{year:04d}",),
+    ).fetchone()
+    return row[0]
 
 def send_monthly_tax_collection_report():
-    """Sends a monthly tax collection report (this is a placeholder)."""
+    """Sends the tax collection report for the previous month."""
     now = datetime.now()
     if now.day == 1:  # Send on the first day of the month
-        total_tax_collection = sum(data[loc].get("monthly_tax_collection", 0) for loc in data)
-        subject = f"Monthly Tax Collection Report ({now.strftime('%Y-%m')})"
-        body = f"Total tax collected across all locations for {now.strftime('%Y-%m')}: ${total_tax_collection:.2f}"
+        last_month = now - timedelta(days=1)
+        try:
+            total_tax_collection = monthly_tax_collection(DATABASE_FILE, last_month.year, last_month.month)
+        except sqlite3.Error as e:
+            print(f"SQLite error: {e}")
+            return
+        subject = f"Monthly Tax Collection Report ({last_month.strftime('%Y-%m')})"
+        body = f"Total tax collected across all locations for {last_month.strftime('%Y-%m')}: ${total_tax_collection:.2f}"
         # Determine who should receive this report (e.g., a central finance manager)
         central_manager_email = "finance_manager@example.com"  # Replace with the actual email
         send_email(central_manager_email, subject, body)
@@ -195,26 +881,75 @@ def send_monthly_tax_collection_report():
     else:
         print("Not the first day of the month, skipping monthly tax report.")
 
-# Schedule the tasks
-schedule.every().hour.do(check_failure_rates)
-schedule.every().day.at("09:00").do(send_daily_financial_reports)
-schedule.every().day.at("10:00").do(detect_anomalies)
-schedule.every().month.at("08:00").do(send_monthly_tax_collection_report) # Will only trigger on the 1st of the month
+def _next_run_time(at, last_run_date=None):
+    """Returns the next HH:MM wall-clock datetime, skipping the day the job last ran."""
+    hour, minute = map(int, at.split(":"))
+    now = datetime.now()
+    target = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    if target <= now or target.date() == last_run_date:
+        target += timedelta(days=1)
+    return target
+
+async def _run_job(job):
+    """Runs a blocking job in a worker thread so it cannot stall the scheduler."""
+    try:
+        await asyncio.to_thread(job)
+    except Exception as e:
+        print(f"Scheduled job {job.__name__} failed: {e}")
+
+async def _every(interval, job):
+    """Runs job every `interval` seconds."""
+    while True:
+        await asyncio.sleep(interval)
+        await _run_job(job)
+
+async def _daily_at(at, job):
+    """Runs job once a day at the HH:MM wall-clock time `at`.
+
+    asyncio.sleep counts monotonic time, so after waking the wall clock is
+    checked again; a DST change or clock step cannot make the job run early
+    or twice on the same day.
+    """
+    last_run_date = None
+    while True:
+        target = _next_run_time(at, last_run_date)
+        while (remaining := (target - datetime.now()).total_seconds()) > 0:
+            await asyncio.sleep(remaining)
+        last_run_date = target.date()
+        await _run_job(job)
+
+async def _run_scheduler():
+    """Schedules the alerting and reporting tasks; the loop sleeps until the next one is due."""
+    await asyncio.gather(
+        _every(3600, check_failure_rates),
+        _daily_at("09:00", send_daily_financial_reports),
+        _daily_at("10:00", detect_anomalies),
+        _daily_at("08:00", send_monthly_tax_collection_report),  # Only sends on the 1st of the month
+    )
+
+def start_scheduler():
+    """Starts the task scheduler on a background thread alongside the REPL."""
+    thread = threading.Thread(target=asyncio.run, args=(_run_scheduler(),), name="scheduler", daemon=True)
+    thread.start()
+    return thread
 
 if __name__ == "__main__":
-    database_file = "jordan_transactions.db"
+    database_file = DATABASE_FILE
     ollama_model_name = "openchat"
 
+    try:
+        create_report_indexes(database_file)
+    except sqlite3.Error as e:
+        print(f"Could not create report indexes: {e}")
+    start_scheduler()
+
     while True:
         user_prompt = input("Enter your query (or type 'exit' to quit): ")
         if user_prompt.lower() == 'exit':
             break
 
-        sql_query = generate_sql_langchain(user_prompt, database_file, ollama_model_name)
-
-        if sql_query:
-            data = fetch_data(database_file, sql_query)
-            rephrased_answer = rephrase_answer_deepseek_api(user_prompt, data)
+        rephrased_answer = answer_query(user_prompt, database_file, ollama_model_name)
+        if rephrased_answer is not None:
             print(rephrased_answer)
         
 